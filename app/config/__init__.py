@@ -1,14 +1,12 @@
 import enum
 import logging
-import os
 from dataclasses import dataclass
 
 import pytz
-from dotenv import load_dotenv
 from envclasses import envclass, load_env
 from pytz import tzinfo
 
-APP_KEY = "app"
+from app.env import TZ
 
 
 class Config:
@@ -26,9 +24,8 @@ class Environments(enum.Enum):
 @dataclass
 class AppConfig(Config):
     def __init__(self):
-        tz_env = os.getenv("TZ", None)
+        tz_env = TZ
         if not tz_env:  # This is not pydantic, we have to take care ourselfs
-            load_dotenv()
             load_env(self, "APP")
 
             if not self.tz:
@@ -48,10 +45,8 @@ class AppConfig(Config):
     segment_write_key: str = "noKey"
 
 
-config = {
-    APP_KEY: AppConfig(),
-}
+app_config = AppConfig()
 
 
 def get_app_config() -> AppConfig:
-    return config.get(APP_KEY)
+    return app_config
@@ -1,2 +1,5 @@
+import sys
+
 QDRANT_ANONYMOUS_ID_KEY = "qd_anonymous_id"
-NON_CONSENTED_USER_ID = "not_consented"
+# Interned, so ids normalized by `utils.get_ids` can be compared with `is`
+NON_CONSENTED_USER_ID = sys.intern("not_consented")
@@ -1,14 +1,19 @@
-import os
+import hmac
 from typing import Optional
 
-from dotenv import load_dotenv
 from fastapi import Header, HTTPException
 
-load_dotenv()
+from app.env import API_AUTHENTICATION_KEY
 
-API_AUTHENTICATION_KEY = os.getenv("API_AUTHENTICATION_KEY")
 
-
-def authenticate(x_api_key: Optional[str] = Header(None, alias="x_api_key")) -> None:
-    if x_api_key != API_AUTHENTICATION_KEY:
+def verify_api_key(x_api_key: Optional[str]) -> None:
+    if (
+        x_api_key is None
+        or API_AUTHENTICATION_KEY is None
+        or not hmac.compare_digest(x_api_key.encode(), API_AUTHENTICATION_KEY.encode())
+    ):
         raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+async def authenticate(x_api_key: Optional[str] = Header(None)) -> None:
+    verify_api_key(x_api_key)
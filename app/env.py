@@ -0,0 +1,16 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Snapshot of the process environment, taken once `.env` has been loaded
+ENV: dict[str, str] = dict(os.environ)
+
+API_AUTHENTICATION_KEY: str | None = ENV.get("API_AUTHENTICATION_KEY")
+ALLOWED_ORIGINS: tuple[str, ...] = tuple(
+    origin.strip()
+    for origin in ENV.get("ALLOWED_ORIGINS", "").split(",")
+    if origin.strip()
+)
+TZ: str | None = ENV.get("TZ")
@@ -1,11 +1,32 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.config import get_app_config
 from app.dependencies import authenticate
 from app.routers import tracking
+from app.segment.service import SegmentService, create_segment_client
 from app.utils import get_allowed_origins
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logging.basicConfig(level=get_app_config().log_level)
+    app.state.segment_client = create_segment_client(
+        write_key=get_app_config().segment_write_key
+    )
+    app.state.segment_service = SegmentService(client=app.state.segment_client)
+    app.state.segment_service.start()
+
+    yield
+
+    # Deliver events still queued before exiting
+    await app.state.segment_service.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,35 +1,34 @@
 import logging
-import uuid
+import secrets
 from typing import Annotated
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
-from qdrant_analytics_events.SegmentIdentify import Model as SegmentIdentify
-from qdrant_analytics_events.SegmentPage import Model as SegmentPage
 
-from app.config import get_app_config
 from app.constants import NON_CONSENTED_USER_ID, QDRANT_ANONYMOUS_ID_KEY
 from app.dependencies import authenticate
-from app.segment.resolver import resolve_segment_service
+from app.segment.resolver import resolve_authenticated_segment_service
 from app.segment.service import SegmentService
-from app.utils import create_args
+from app.utils import build_identify_model, build_page_model, build_track_model, get_ids
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=get_app_config().log_level)
 
 router = APIRouter()
 
+HEALTHCHECK_RESPONSE = orjson.dumps({"message": "healthcheck successful"})
 
-@router.get("/healthcheck")
-async def healthcheck(request: Request):
-    return {"message": "healthcheck successful"}
+
+@router.get("/healthcheck", response_class=Response)
+async def healthcheck():
+    return Response(content=HEALTHCHECK_RESPONSE, media_type="application/json")
 
 
 @router.get("/anonymous_id")
 async def get_anonymous_id(
     response: Response, request: Request, _: str = Depends(authenticate)
 ):
-    anonymous_id = str(uuid.uuid4())
+    anonymous_id = secrets.token_hex(16)
     response.set_cookie(
         key=QDRANT_ANONYMOUS_ID_KEY,
         value=anonymous_id,
@@ -49,51 +48,64 @@ async def get_anonymous_id(
 @router.post("/identify")
 async def identify(
     request: Request,
-    segment_service: Annotated[SegmentService, Depends(resolve_segment_service)],
-    _: str = Depends(authenticate),
+    segment_service: Annotated[
+        SegmentService, Depends(resolve_authenticated_segment_service)
+    ],
 ):
     try:
-        user_id, anonymous_id, args, data = await create_args(
-            request, exclude_properties=True
-        )
-        args["traits"] = data.get("traits", {})
+        body = orjson.loads(await request.body())
+        user_id, anonymous_id = get_ids(body)
 
         if (
-            anonymous_id != NON_CONSENTED_USER_ID
+            anonymous_id is not NON_CONSENTED_USER_ID
         ):  # DO NOT associate a user_id with NON_CONSENTED_USER_ID
-            segment_service.identify(
-                SegmentIdentify(user_id=user_id, anonymous_id=anonymous_id, **args)
+            event = build_identify_model(
+                body, request, user_id=user_id, anonymous_id=anonymous_id
             )
+            success = segment_service.identify(event)
         else:
             msg = f"User ({NON_CONSENTED_USER_ID}) was not identified"
             logger.warning(msg)
             return {"message": msg}
 
-        return {"message": "User identified successfully"}
+        if success:
+            return {"message": "User identified successfully"}
+        else:
+            raise HTTPException(
+                status_code=500, detail="User identify failed. Check logs"
+            )
+
     except Exception as error:
-        logger.error(f"Error (calling identify): {error}")
-        return {"Error": error}
+        msg = f"Error (calling /identify): {error}"
+
+        logger.error(msg)
+
+        raise HTTPException(
+            status_code=500,
+            detail=msg,
+        )
 
 
 # https://segment.com/docs/connections/sources/catalog/libraries/server/python/#track
 @router.post("/track")
 async def track_event(
     request: Request,
-    segment_service: Annotated[SegmentService, Depends(resolve_segment_service)],
-    _: str = Depends(authenticate),
+    segment_service: Annotated[
+        SegmentService, Depends(resolve_authenticated_segment_service)
+    ],
 ):
     try:
-        data = await request.json()
-        args = await create_args(request, data)
+        body = orjson.loads(await request.body())
+        event = build_track_model(body, request)
 
-        success = segment_service.track_event(args)
+        success = segment_service.track_event(event)
 
         if success:
             return {"message": "Event tracked successfully"}
         else:
             raise HTTPException(
                 status_code=500,
-                detail=f"Event track failed. Check logs for event: {args['event_name']}",
+                detail=f"Event track failed. Check logs for event: {event.event_name}",
             )
 
     except Exception as error:
@@ -111,19 +123,30 @@ async def track_event(
 @router.post("/page")
 async def page_viewed(
     request: Request,
-    segment_service: Annotated[SegmentService, Depends(resolve_segment_service)],
-    _: str = Depends(authenticate),
+    segment_service: Annotated[
+        SegmentService, Depends(resolve_authenticated_segment_service)
+    ],
 ):
-    user_id, anonymous_id, args, data = await create_args(request)
-    args["category"] = data.get("category")
-
-    segment_service.page_viewed(
-        SegmentPage(
-            user_id=user_id,
-            anonymous_id=anonymous_id,
-            name=data.get("name"),  # was formally title
-            **args,
-        )
-    )
+    try:
+        body = orjson.loads(await request.body())
+        event = build_page_model(body, request)
+
+        success = segment_service.page_viewed(event)
+
+        if success:
+            return {"message": "Page view tracked successfully"}
+        else:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Page view track failed. Check logs for event: {event.event_name}",
+            )
 
-    return {"message": "Page view tracked successfully"}
+    except Exception as error:
+        msg = f"Error (calling /page): {error}"
+
+        logger.error(msg)
+
+        raise HTTPException(
+            status_code=500,
+            detail=msg,
+        )
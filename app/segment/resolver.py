@@ -1,15 +1,17 @@
-from typing import Annotated
+from typing import Optional
 
-from fastapi import BackgroundTasks, Depends
+from fastapi import Header, Request
 
-from app.config import AppConfig, get_app_config
+from app.dependencies import verify_api_key
 from app.segment.service import SegmentService
 
 
-def resolve_segment_service(
-    app_config: Annotated[AppConfig, Depends(get_app_config)],
-    background_tasks: BackgroundTasks,
-):
-    return SegmentService(
-        write_key=app_config.segment_write_key, background_tasks=background_tasks
-    )
+async def resolve_authenticated_segment_service(
+    request: Request, x_api_key: Optional[str] = Header(None)
+) -> SegmentService:
+    """
+    Authenticate the request and resolve the shared Segment service, as a single
+    dependency.
+    """
+    verify_api_key(x_api_key)
+    return request.app.state.segment_service
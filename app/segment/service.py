@@ -1,91 +1,177 @@
+import asyncio
 import logging
-from datetime import datetime
-from typing import Literal, TypeVar, Union
+import time
+from typing import Callable, Literal, TypeVar
 
 import segment.analytics as analytics
-from fastapi import BackgroundTasks
-from qdrant_analytics_events.index import QdrantAnalyticsEvents
-from qdrant_analytics_events.Interaction import Model as InteractionEvent
 from qdrant_analytics_events.SegmentIdentify import Model as SegmentIdentify
 from qdrant_analytics_events.SegmentPage import Model as SegmentPage
 from qdrant_analytics_events.SegmentTrack import Model as SegmentTrack
 
 from app.constants import NON_CONSENTED_USER_ID
-from app.utils import date_format
-
-any_model = InteractionEvent(location="", label="")
-EventType = Union[type(QdrantAnalyticsEvents(any_model).root)]  # type: ignore - Type[] doesn't do it, but type() works!
+from app.utils import parse_timestamp
 
 logger = logging.getLogger(__name__)
 
+# Minimum seconds between two "queue is full" warnings
+DROPPED_EVENTS_LOG_INTERVAL = 10.0
+
+
 TSegmentPage = TypeVar("TSegmentPage", bound=SegmentPage)
 TSegmentTrack = TypeVar("TSegmentTrack", bound=SegmentTrack)
 TSegmentIdentify = TypeVar("TSegmentIdentify", bound=SegmentIdentify)
 
 
+def create_segment_client(write_key: str, send: bool = True) -> analytics.Client:
+    """
+    Create the Segment client shared by all requests.
+
+    Its consumer thread uploads queued events in batches of up to `upload_size`
+    through the SDK's module-level `requests` session, so the connection to Segment
+    is kept alive and reused across batches.
+
+    :param str write_key: Segment's workspace write key
+    :param bool send: Whether events are actually sent to Segment
+    :return: Segment client
+    """
+
+    return analytics.Client(
+        write_key=write_key,
+        debug=False,
+        sync_mode=False,  # events are uploaded by the client's consumer thread
+        max_retries=2,
+        timeout=3,
+        upload_size=100,
+        max_queue_size=10000,
+        send=send,
+        on_error=SegmentService._on_error,
+        host="https://events.eu1.segmentapis.com",
+    )
+
+
 class SegmentService:
     """
-    Segment service acts as a facade for Segment API with background tasks.
+    Segment service acts as a facade for Segment API. Events are put on a bounded
+    queue and handed to the shared client by a drain task running on the event loop,
+    whenever the handler yields; the client then uploads them in batches from its
+    consumer thread.
     """
 
     def __init__(
         self,
         *,
-        write_key: str,
-        background_tasks: BackgroundTasks,
+        client: analytics.Client,
         source_name: Literal[
             "default", "server_side_analytics"
         ] = "server_side_analytics",
-        send: bool = True,
+        max_queue_size: int = 10000,
     ):
         """
         Initialize Segment service.
 
-        :param str write_key: Segment's workspace write key
-        :param BackgroundTasks background_tasks: Background task manager
+        :param analytics.Client client: Shared Segment client
         :param str source_name: Source/Origin Name
+        :param int max_queue_size: Events kept pending before new ones are dropped
         """
-        self.analytics = analytics.Client(
-            write_key=write_key,
-            debug=False,
-            sync_mode=True,
-            max_retries=2,
-            timeout=3,
-            upload_size=1,  # 1 event per request, to avoid batching
-            send=send,
-            on_error=self._on_error,
-            host="https://events.eu1.segmentapis.com",
-        )
-        self.background_tasks = background_tasks
+        self.analytics = client
         self.source_name = source_name
+        self.queue: asyncio.Queue[tuple[Callable[..., None], tuple]] = asyncio.Queue(
+            max_queue_size
+        )
+        self._drain_task: asyncio.Task | None = None
+        self.dropped_events = 0
+        self._dropped_since_log = 0
+        self._last_drop_log = float("-inf")
+
+    def start(self) -> None:
+        """
+        Start draining queued events. Must be called from the running event loop.
+        """
+
+        self._drain_task = asyncio.create_task(self._drain())
+
+    async def stop(self) -> None:
+        """
+        Hand all queued events to the client, stop draining and shut the client down.
+        """
+
+        if self._drain_task is not None:
+            # A finished task would never empty the queue
+            if not self._drain_task.done():
+                await self.queue.join()
+            self._drain_task.cancel()
+            self._drain_task = None
+
+        # Flushing blocks until uploads (and any rate limit) complete
+        await asyncio.to_thread(self.analytics.shutdown)
+
+    async def _drain(self) -> None:
+        while True:
+            send, args = await self.queue.get()
+            try:
+                send(*args)
+            except Exception as error:
+                self._on_error(error)
+            finally:
+                self.queue.task_done()
+
+    def _enqueue(self, send: Callable[..., None], *args) -> bool:
+        """
+        Queue an event for the drain task, dropping it if the queue is full.
+
+        :param Callable send: Method sending the event to the Segment client
+        :return: Whether the event was queued
+        """
+
+        try:
+            self.queue.put_nowait((send, args))
+            return True
+        except asyncio.QueueFull:
+            self._drop_event()
+            return False
+
+    def _drop_event(self) -> None:
+        """
+        Count an event dropped by either queue (this service's or the Segment
+        client's), warning with the count at most every `DROPPED_EVENTS_LOG_INTERVAL`.
+        """
+
+        self.dropped_events += 1
+        self._dropped_since_log += 1
+
+        now = time.monotonic()
+        if now - self._last_drop_log >= DROPPED_EVENTS_LOG_INTERVAL:
+            logger.warning(
+                "Segment event queue is full, %s event(s) dropped",
+                self._dropped_since_log,
+            )
+            self._dropped_since_log = 0
+            self._last_drop_log = now
 
     ############
     # Identify #
     ############
-    def identify(self, event: TSegmentIdentify) -> None:  # type: ignore
+    def identify(self, event: TSegmentIdentify) -> bool:  # type: ignore
         """
-        Identify Segment user in a background task, after the response is sent.
+        Identify Segment user, queueing the event for upload.
 
-        :param str user_id: User id
-        :param str anonymous_id: Anonymous id
         :param TSegmentIdentify event: Identify event model
-        :return: None
+        :return: Whether the event was queued
         """
 
         try:
-            event = SegmentIdentify.model_validate(event)
-            event_props = event.model_dump(mode="json")
+            # `event_name` is not an argument of Segment calls
+            event_props = event.model_dump(exclude={"event_name"}, exclude_none=True)
             user_id = event_props.pop("user_id", None)
             anonymous_id = event_props.pop("anonymous_id", NON_CONSENTED_USER_ID)
 
             if user_id is None or anonymous_id is None:
                 raise ValueError("`user_id` and `anonymous id` are required")
 
-            self.background_tasks.add_task(
-                self._identify, user_id, anonymous_id, event_props
-            )
+            return self._enqueue(self._identify, user_id, anonymous_id, event_props)
         except Exception as error:
             self._on_error(error)
+            return False
 
     def _identify(
         self,
@@ -95,8 +181,8 @@ class SegmentService:
     ) -> None:
         """
         Identify (event) in Segment.
-        If an exception occurs, the background task will be dropped
-        and the event will not be tracked.
+        If an exception occurs, the event will be dropped
+        and will not be tracked.
 
         :param str user_id: User id
         :param str anonymous_id: Anonymous id
@@ -105,7 +191,7 @@ class SegmentService:
 
         try:
             event_props["timestamp"] = (
-                datetime.strptime(event_props["timestamp"], date_format)
+                parse_timestamp(event_props["timestamp"])
                 if event_props["timestamp"]
                 else None
             )
@@ -114,38 +200,32 @@ class SegmentService:
                 user_id=user_id, anonymous_id=anonymous_id, **event_props
             )
             if success:
-                logger.info("User identify succeeded: %s. %s", msg, event_props)
+                logger.info("User identify queued: %s", msg["messageId"])
             else:
-                logger.warning(
-                    "User identify did not succeed: %s. %s", msg, event_props
-                )
+                self._drop_event()
+                logger.info("User identify was not queued: %s", msg.get("messageId"))
         except Exception as error:
             self._on_error(error)
 
     #############
     # Page View #
     #############
-    def page_viewed(self, event: TSegmentPage) -> None:  # type: ignore
+    def page_viewed(self, event: TSegmentPage) -> bool:  # type: ignore
         """
-        Page event in Segment in a background task, after the response is sent.
+        Page event in Segment, queueing the event for upload.
 
-        :param str user_id: User id
-        :param str anonymous_id: Anonymous id (set to "not_consented" if user hasn't opted in)
         :param TSegmentPage event: SegmentPage event model
-        :return: None
+        :return: Whether the event was queued
         """
 
-        event = SegmentPage.model_validate(event)
-        event_props = event.model_dump(mode="json")
+        event_props = event.model_dump(exclude={"event_name"}, exclude_none=True)
         user_id = event_props.pop("user_id", None)
         anonymous_id = event_props.pop("anonymous_id", NON_CONSENTED_USER_ID)
 
         if user_id is None and anonymous_id is None:
             raise ValueError("`user_id` or `anonymous id` are required")
 
-        self.background_tasks.add_task(
-            self._page_viewed, user_id, anonymous_id, event_props
-        )
+        return self._enqueue(self._page_viewed, user_id, anonymous_id, event_props)
 
     def _page_viewed(
         self,
@@ -155,8 +235,8 @@ class SegmentService:
     ) -> None:
         """
         Track Page Viewed (event) in Segment.
-        If an exception occurs, the background task will be dropped
-        and the event will not be tracked.
+        If an exception occurs, the event will be dropped
+        and will not be tracked.
 
         :param str user_id: User id
         :param str anonymous_id: Anonymous id (set to "not_consented" if user hasn't opted in)
@@ -165,7 +245,7 @@ class SegmentService:
 
         try:
             event_props["timestamp"] = (
-                datetime.strptime(event_props["timestamp"], date_format)
+                parse_timestamp(event_props["timestamp"])
                 if event_props["timestamp"]
                 else None
             )
@@ -175,37 +255,33 @@ class SegmentService:
                 user_id=user_id, anonymous_id=anonymous_id, **event_props
             )
             if success:
-                logger.info("Event tracking succeeded: %s. %s", msg, event_props)
+                logger.info("Page view queued: %s", msg["messageId"])
             else:
-                logger.warning(
-                    "Event tracking did not succeed: %s. %s", msg, event_props
-                )
+                self._drop_event()
+                logger.info("Page view was not queued: %s", msg.get("messageId"))
         except Exception as error:
             self._on_error(error)
 
     #########
     # Track #
     #########
-    def track_event(self, event_payload: dict) -> bool:  # type: ignore
+    def track_event(self, event: TSegmentTrack) -> bool:  # type: ignore
         """
-        Track event in Segment in a background task, after the response is sent.
+        Track event in Segment, queueing the event for upload.
 
         :param TSegmentTrack event: SegmentTrack event model
-        :return: None
+        :return: Whether the event was queued
         """
 
         try:
-            event = SegmentTrack.model_validate(event_payload)
-            event_props = event.model_dump(mode="json")
+            event_props = event.model_dump(exclude_none=True)
 
-            if event_props["user_id"] is None and event_props["anonymous_id"] is None:
+            if "user_id" not in event_props and "anonymous_id" not in event_props:
                 raise ValueError(
                     "`user_id` (or `anonymous_id`) and `event_name` are required"
                 )
 
-            self.background_tasks.add_task(self._track_event, event_props)
-
-            return True
+            return self._enqueue(self._track_event, event_props)
 
         except Exception as error:
             logger.warning(f"Error (calling track_event): {error}")
@@ -214,8 +290,8 @@ class SegmentService:
     def _track_event(self, event_props: dict) -> None:
         """
         Track event in Segment.
-        If an exception occurs, the background task will be dropped
-        and the event will not be tracked.
+        If an exception occurs, the event will be dropped
+        and will not be tracked.
 
         :param dict event_props: { event_name, user_id, anonymous_id, properties, context, integrations, timestamp }
         :return: None
@@ -223,14 +299,14 @@ class SegmentService:
 
         try:
             event_props["timestamp"] = (
-                datetime.strptime(event_props["timestamp"], date_format)
+                parse_timestamp(event_props["timestamp"])
                 if event_props["timestamp"]
                 else None
             )
 
             event = event_props.pop("event_name")
-            user_id = event_props.pop("user_id")
-            anonymous_id = event_props.pop("anonymous_id")
+            user_id = event_props.pop("user_id", None)
+            anonymous_id = event_props.pop("anonymous_id", None)
 
             success, msg = self.analytics.track(
                 user_id=user_id,
@@ -240,19 +316,24 @@ class SegmentService:
             )
 
             if success:
-                logger.info("Event tracking succeeded: %s. %s", msg, event_props)
+                logger.info("Event tracking queued: %s (%s)", event, msg["messageId"])
             else:
-                logger.warning(
-                    "Event tracking did not succeed: %s. %s", msg, event_props
+                self._drop_event()
+                logger.info(
+                    "Event tracking was not queued: %s (%s)",
+                    event,
+                    msg.get("messageId"),
                 )
         except Exception as error:
             self._on_error(error)
 
-    def _on_error(self, error: Exception) -> None:
+    @staticmethod
+    def _on_error(error: Exception, batch: list | None = None) -> None:
         """
         Handle error in Segment.
 
         :param Exception error: Error
+        :param list batch: Batch of events that failed to upload, if any
         """
 
         logging.error(error, exc_info=True)
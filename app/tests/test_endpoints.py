@@ -1,6 +1,7 @@
 import logging
 import os
 
+import pytest
 from fastapi.testclient import TestClient
 
 from app.constants import NON_CONSENTED_USER_ID, QDRANT_ANONYMOUS_ID_KEY
@@ -8,7 +9,12 @@ from app.main import app
 
 logging.basicConfig(level=logging.DEBUG)
 
-client = TestClient(app)
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
 
 headers = {"x-api-key": os.getenv("API_AUTHENTICATION_KEY")}
 json_body_template = {
@@ -21,15 +27,15 @@ json_body_template = {
 
 
 # Happy Paths
-def test_anonymous_id():
+def test_anonymous_id(client):
     response = client.get("/anonymous_id", headers=headers)
     response_obj = response.json()
 
     assert response.status_code == 200
-    assert len(response_obj[QDRANT_ANONYMOUS_ID_KEY]) == 36
+    assert len(response_obj[QDRANT_ANONYMOUS_ID_KEY]) == 32
 
 
-def test_identify():
+def test_identify(client):
     json_body_template["userId"] = "test_user_id"
     response = client.post("/identify", headers=headers, json=json_body_template)
     response_obj = response.json()
@@ -38,7 +44,7 @@ def test_identify():
     assert "User identified successfully" == response_obj["message"]
 
 
-def test_page():
+def test_page(client):
     json_body_template["category"] = "test category"
     json_body_template["name"] = "test name"
     json_body_template["properties"]["title"] = "test title"
@@ -51,7 +57,7 @@ def test_page():
     assert "Page view tracked successfully" == response_obj["message"]
 
 
-def test_track():
+def test_track(client):
     json_body_template["event"] = "interaction"
     response = client.post("/track", headers=headers, json=json_body_template)
     response_obj = response.json()
@@ -61,7 +67,7 @@ def test_track():
 
 
 # Sad Paths
-def test_anonymous_id_no_auth():
+def test_anonymous_id_no_auth(client):
     response = client.get("/anonymous_id", headers={})
     response_obj = response.json()
 
@@ -69,7 +75,33 @@ def test_anonymous_id_no_auth():
     assert response_obj["detail"] == "Unauthorized"
 
 
-def test_identify_empty_body():
+def test_track_wrong_api_key(client):
+    response = client.post("/track", headers={"x-api-key": "wrong"}, json={})
+    response_obj = response.json()
+
+    assert response.status_code == 401
+    assert response_obj["detail"] == "Unauthorized"
+
+
+def test_track_no_auth(client):
+    response = client.post("/track", headers={}, json={})
+    response_obj = response.json()
+
+    assert response.status_code == 401
+    assert response_obj["detail"] == "Unauthorized"
+
+
+def test_track_api_key_not_configured(client, monkeypatch):
+    monkeypatch.setattr("app.dependencies.API_AUTHENTICATION_KEY", None)
+
+    response = client.post("/track", headers=headers, json={})
+    response_obj = response.json()
+
+    assert response.status_code == 401
+    assert response_obj["detail"] == "Unauthorized"
+
+
+def test_identify_empty_body(client):
     response = client.post("/identify", headers=headers, json={})
     response_obj = response.json()
 
@@ -77,3 +109,28 @@ def test_identify_empty_body():
     assert (
         f"User ({NON_CONSENTED_USER_ID}) was not identified" == response_obj["message"]
     )
+
+
+def test_identify_missing_user_id(client):
+    body = {"anonymousId": "test_anonymous_id", "traits": {}}
+    response = client.post("/identify", headers=headers, json=body)
+    response_obj = response.json()
+
+    assert response.status_code == 500
+    assert response_obj["detail"].startswith("Error (calling /identify)")
+
+
+def test_identify_malformed_body(client):
+    response = client.post("/identify", headers=headers, content=b"{not json")
+
+    assert response.status_code == 500
+    assert "not json" not in response.text
+
+
+def test_page_non_string_anonymous_id(client):
+    body = {"anonymousId": 123, "name": "test name", "properties": {}}
+    response = client.post("/page", headers=headers, json=body)
+    response_obj = response.json()
+
+    assert response.status_code == 500
+    assert response_obj["detail"].startswith("Error (calling /page)")
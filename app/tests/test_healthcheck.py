@@ -1,11 +1,16 @@
+import pytest
 from fastapi.testclient import TestClient
 
 from app.main import app
 
-client = TestClient(app)
 
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
 
-def test_healthcheck():
+
+def test_healthcheck(client):
     response = client.get("/healthcheck")
     response_obj = response.json()
 
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from qdrant_analytics_events.SegmentTrack import Model as SegmentTrack
+
+from app.constants import NON_CONSENTED_USER_ID
+from app.main import app
+from app.segment.service import SegmentService
+
+headers = {"x-api-key": os.getenv("API_AUTHENTICATION_KEY")}
+
+
+class StubSegmentClient:
+    """
+    Records the calls the Segment service makes instead of queueing them for upload.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.is_shut_down = False
+
+    def _record(self, method: str, kwargs: dict):
+        self.calls.append((method, kwargs))
+        return True, {"messageId": f"message-{len(self.calls)}"}
+
+    def identify(self, **kwargs):
+        return self._record("identify", kwargs)
+
+    def page(self, **kwargs):
+        return self._record("page", kwargs)
+
+    def track(self, **kwargs):
+        return self._record("track", kwargs)
+
+    def shutdown(self):
+        self.is_shut_down = True
+
+
+class FullSegmentClient(StubSegmentClient):
+    """
+    Rejects every call, as the Segment client does once its own queue is full.
+    """
+
+    def _record(self, method: str, kwargs: dict):
+        self.calls.append((method, kwargs))
+        return False, {**kwargs, "messageId": f"message-{len(self.calls)}"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def segment_client(client, monkeypatch):
+    segment_client = StubSegmentClient()
+    monkeypatch.setattr(app.state.segment_service, "analytics", segment_client)
+    return segment_client
+
+
+def deliver(client: TestClient) -> None:
+    # Wait for the drain task to hand queued events to the client
+    client.portal.call(app.state.segment_service.queue.join)
+
+
+def track_event(anonymous_id: str = "test_anonymous_id") -> SegmentTrack:
+    return SegmentTrack(
+        event_name="interaction",
+        anonymous_id=anonymous_id,
+        properties={},
+        timestamp="",
+    )
+
+
+# Endpoints
+def test_identify_delivers_event(client, segment_client):
+    body = {
+        "userId": "test_user_id",
+        "anonymousId": "test_anonymous_id",
+        "traits": {"email": "test@qdrant.tech"},
+        "originalTimestamp": "2024-01-01T00:00:00.000Z",
+    }
+    response = client.post("/identify", headers=headers, json=body)
+    deliver(client)
+
+    assert response.status_code == 200
+    [(method, kwargs)] = segment_client.calls
+    assert method == "identify"
+    assert kwargs["user_id"] == "test_user_id"
+    assert kwargs["anonymous_id"] == "test_anonymous_id"
+    assert kwargs["traits"] == {"email": "test@qdrant.tech"}
+    assert kwargs["timestamp"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert kwargs["context"]["ip"] == "testclient"
+    assert "event_name" not in kwargs
+
+
+def test_page_delivers_event(client, segment_client):
+    body = {
+        "anonymousId": "test_anonymous_id",
+        "name": "test name",
+        "category": "test category",
+        "properties": {"url": "https://qdrant.tech/docs/?q=test"},
+        "originalTimestamp": "",
+    }
+    response = client.post("/page", headers=headers, json=body)
+    deliver(client)
+
+    assert response.status_code == 200
+    [(method, kwargs)] = segment_client.calls
+    assert method == "page"
+    assert kwargs["anonymous_id"] == "test_anonymous_id"
+    assert kwargs["name"] == "test name"
+    assert kwargs["category"] == "test category"
+    assert kwargs["timestamp"] is None
+    assert kwargs["properties"]["path"] == "/docs/"
+    assert kwargs["properties"]["search"] == "q=test"
+    assert kwargs["properties"]["source"] == "server_side_analytics"
+    assert "event_name" not in kwargs
+
+
+def test_track_delivers_event(client, segment_client):
+    body = {
+        "event": "interaction",
+        "userId": "test_user_id",
+        "anonymousId": "test_anonymous_id",
+        "properties": {"label": "test label"},
+    }
+    response = client.post("/track", headers=headers, json=body)
+    deliver(client)
+
+    assert response.status_code == 200
+    [(method, kwargs)] = segment_client.calls
+    assert method == "track"
+    assert kwargs["event"] == "interaction"
+    assert kwargs["user_id"] == "test_user_id"
+    assert kwargs["anonymous_id"] == "test_anonymous_id"
+    assert kwargs["properties"]["label"] == "test label"
+
+
+def test_track_snake_case_body_delivers_event(client, segment_client):
+    body = {
+        "event_name": "interaction",
+        "user_id": "test_user_id",
+        "anonymous_id": "test_anonymous_id",
+        "properties": {},
+    }
+    response = client.post("/track", headers=headers, json=body)
+    deliver(client)
+
+    assert response.status_code == 200
+    [(_, kwargs)] = segment_client.calls
+    assert kwargs["event"] == "interaction"
+    assert kwargs["user_id"] == "test_user_id"
+    assert kwargs["anonymous_id"] == "test_anonymous_id"
+
+
+def test_track_non_consented_has_empty_context(client, segment_client):
+    body = {"event": "interaction", "properties": {}}
+    response = client.post(
+        "/track", headers={**headers, "user-agent": "test agent"}, json=body
+    )
+    deliver(client)
+
+    assert response.status_code == 200
+    [(_, kwargs)] = segment_client.calls
+    assert kwargs["anonymous_id"] == NON_CONSENTED_USER_ID
+    assert kwargs["context"] == {}
+
+
+def test_page_reports_dropped_event(client, segment_client, monkeypatch):
+    full_queue = asyncio.Queue(1)
+    full_queue.put_nowait((segment_client.page, ()))
+    monkeypatch.setattr(app.state.segment_service, "queue", full_queue)
+
+    body = {"anonymousId": "test_anonymous_id", "name": "test name"}
+    response = client.post("/page", headers=headers, json=body)
+
+    assert response.status_code == 500
+    assert segment_client.calls == []
+
+
+# Queue
+def test_full_queue_drops_event(caplog):
+    async def enqueue_twice():
+        service = SegmentService(client=StubSegmentClient(), max_queue_size=1)
+        return (
+            service,
+            service.track_event(track_event()),
+            service.track_event(track_event()),
+        )
+
+    with caplog.at_level(logging.WARNING, logger="app.segment.service"):
+        service, first, second = asyncio.run(enqueue_twice())
+
+    assert first is True
+    assert second is False
+    assert service.dropped_events == 1
+    assert service.queue.qsize() == 1
+    assert "1 event(s) dropped" in caplog.text
+    assert "test_anonymous_id" not in caplog.text
+
+
+def test_full_client_queue_drops_event(caplog):
+    segment_client = FullSegmentClient()
+
+    async def enqueue_and_stop():
+        service = SegmentService(client=segment_client)
+        service.start()
+        accepted = [service.track_event(track_event()) for _ in range(3)]
+        await service.stop()
+        return service, accepted
+
+    with caplog.at_level(logging.INFO, logger="app.segment.service"):
+        service, accepted = asyncio.run(enqueue_and_stop())
+
+    assert accepted == [True, True, True]
+    assert len(segment_client.calls) == 3
+    assert service.dropped_events == 3
+    assert "1 event(s) dropped" in caplog.text
+    assert "message-3" in caplog.text
+    assert "test_anonymous_id" not in caplog.text
+
+
+def test_drain_survives_failing_send():
+    segment_client = StubSegmentClient()
+
+    def fail(*args):
+        raise RuntimeError("send failed")
+
+    async def enqueue_and_stop():
+        service = SegmentService(client=segment_client)
+        service.start()
+        service._enqueue(fail)
+        service.track_event(track_event())
+        await service.stop()
+
+    asyncio.run(asyncio.wait_for(enqueue_and_stop(), timeout=5))
+
+    assert [method for method, _ in segment_client.calls] == ["track"]
+    assert segment_client.is_shut_down
+
+
+def test_stop_drains_queue():
+    segment_client = StubSegmentClient()
+
+    async def enqueue_and_stop():
+        service = SegmentService(client=segment_client)
+        service.start()
+        service.track_event(track_event("first"))
+        service.track_event(track_event("second"))
+        await service.stop()
+        return service
+
+    service = asyncio.run(enqueue_and_stop())
+
+    assert [kwargs["anonymous_id"] for _, kwargs in segment_client.calls] == [
+        "first",
+        "second",
+    ]
+    assert service.queue.empty()
+    assert segment_client.is_shut_down
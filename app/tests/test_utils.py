@@ -0,0 +1,33 @@
+from app.constants import NON_CONSENTED_USER_ID
+from app.utils import format_context, get_ids
+
+context_kwargs = {"ip": "127.0.0.1", "user_agent": "test agent", "locale": "en-US"}
+
+
+def test_get_ids_camel_case():
+    data = {"userId": "test_user_id", "anonymousId": "test_anonymous_id"}
+
+    assert get_ids(data) == ("test_user_id", "test_anonymous_id")
+
+
+def test_get_ids_snake_case_fallback():
+    data = {"user_id": "test_user_id", "anonymous_id": "test_anonymous_id"}
+
+    assert get_ids(data) == ("test_user_id", "test_anonymous_id")
+
+
+def test_get_ids_without_anonymous_id():
+    assert get_ids({}) == (None, NON_CONSENTED_USER_ID)
+
+
+def test_get_ids_non_string_anonymous_id():
+    assert get_ids({"anonymousId": 123}) == (None, 123)
+
+
+def test_format_context_non_interned_non_consented_id():
+    anonymous_id = "".join(["not_", "consented"])
+    assert anonymous_id is not NON_CONSENTED_USER_ID
+
+    context = format_context({}, {}, anonymous_id, **context_kwargs)
+
+    assert context == {}
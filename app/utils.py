@@ -1,61 +1,54 @@
-import os
-from datetime import datetime, timezone
+import sys
+from datetime import datetime
 from typing import Tuple
+from urllib.parse import urlsplit
 
-from dotenv import load_dotenv
 from fastapi import Request
+from qdrant_analytics_events.SegmentIdentify import Model as SegmentIdentify
+from qdrant_analytics_events.SegmentPage import Model as SegmentPage
+from qdrant_analytics_events.SegmentTrack import Model as SegmentTrack
 
-from app.config import get_app_config
 from app.constants import NON_CONSENTED_USER_ID
+from app.env import ALLOWED_ORIGINS
 
-load_dotenv()
 
-date_format = "%Y-%m-%dT%H:%M:%S.%fZ"
-
-
-def now_tz() -> datetime:
+def parse_timestamp(timestamp: str) -> datetime:
     """
-    Create a `datetime` instance with proper `tzinfo` in it. This will not be converted
-    to `UTC`
+    Parse an ISO 8601 timestamp (e.g. `2024-01-01T00:00:00.000Z`) into a `UTC`
+    aware `datetime`.
     """
-    config = get_app_config()
-    return datetime.now(config.timezone)
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
 
 
-def utc_now() -> datetime:
-    """
-    Create a `datetime` instance with proper `tzinfo` in it already `UTC` converted.
-    """
-    return now_tz().astimezone(timezone.utc)
-
-
-def get_allowed_origins():
-    origins = os.getenv("ALLOWED_ORIGINS", "").split(",")
-    return [origin.strip() for origin in origins if origin.strip()]
+def get_allowed_origins() -> Tuple[str, ...]:
+    return ALLOWED_ORIGINS
 
 
 def get_ids(data: dict) -> Tuple[str, str]:
-    user_id = data.get("user_id", None) if "user_id" in data else None
-    anonymous_id = data.get("anonymous_id", None) or NON_CONSENTED_USER_ID
+    # Payloads follow Segment's camelCase keys, snake_case is still accepted
+    user_id = data.get("userId", data.get("user_id"))
+    anonymous_id = data.get("anonymousId", data.get("anonymous_id"))
+    if not anonymous_id:
+        anonymous_id = NON_CONSENTED_USER_ID
+    elif isinstance(anonymous_id, str):
+        anonymous_id = sys.intern(anonymous_id)
 
     return user_id, anonymous_id
 
 
-def format_properties(request: Request, data: dict) -> dict:
+def format_properties(data: dict, *, referrer: str | None) -> dict:
     """
     Formatting the "properties" object for Segment consumption
     """
 
     properties = data.get("properties", {})
 
-    origin = request.headers.get("origin", False)
-    if "url" in properties and origin:
-        path_and_search = properties["url"].replace(origin, "")
-        path, _, search = path_and_search.partition("?")
-        properties["path"] = path
-        properties["search"] = search
+    if "url" in properties:
+        url = urlsplit(properties["url"])
+        properties["path"] = url.path
+        properties["search"] = url.query
 
-    properties["referrer"] = request.headers.get("referer", None)
+    properties["referrer"] = referrer
     properties["originalTimestamp"] = data.get("originalTimestamp", None)
 
     if data.get("name"):  # Page events have a name property
@@ -65,7 +58,13 @@ def format_properties(request: Request, data: dict) -> dict:
 
 
 def format_context(
-    request: Request, data: dict, properties: dict, anonymous_id: str
+    data: dict,
+    properties: dict,
+    anonymous_id: str,
+    *,
+    ip: str | None,
+    user_agent: str | None,
+    locale: str,
 ) -> dict:
     """
     Formatting the "context" object for Segment consumption
@@ -77,35 +76,88 @@ def format_context(
 
     context = data.get("context", {})
 
-    context["ip"] = request.client.host
-    context["userAgent"] = request.headers.get("user-agent", None)
-    context["locale"] = request.headers.get("Accept-Language", "").split(",")[0]
-
-    properties = format_properties(request, properties)
-    properties.pop("name", None)
-    context["page"] = properties
+    context["ip"] = ip
+    context["userAgent"] = user_agent
+    context["locale"] = locale
+    context["page"] = {key: value for key, value in properties.items() if key != "name"}
 
     return context
 
 
-async def create_args(
-    request: Request, data: dict, exclude_properties: bool = False
+def format_request_context(
+    request: Request, data: dict, properties: dict, anonymous_id: str
 ) -> dict:
-    [user_id, anonymous_id] = get_ids(data)
+    """
+    Formatting the "context" object from the request's client and headers
+    """
 
-    args = {
-        "event_name": data.get("event_name", "no event name"),
-        "user_id": user_id,
-        "anonymous_id": anonymous_id,
-        "integrations": data.get("integrations", {}),
-        "timestamp": data.get("originalTimestamp", utc_now().strftime(date_format)),
-    }
+    headers = request.headers
 
-    properties = format_properties(request, data)
+    return format_context(
+        data,
+        properties,
+        anonymous_id,
+        ip=request.client.host if request.client else None,
+        user_agent=headers.get("user-agent"),
+        locale=headers.get("accept-language", "").split(",", 1)[0],
+    )
 
-    if not exclude_properties:
-        args["properties"] = properties
 
-    args["context"] = format_context(request, data, properties, anonymous_id)
+def build_identify_model(
+    body: dict, request: Request, *, user_id: str | None, anonymous_id: str
+) -> SegmentIdentify:
+    """
+    Build a `SegmentIdentify` event from the request body and the ids the caller
+    already read from it with `get_ids`
+    """
+
+    properties = format_properties(body, referrer=request.headers.get("referer"))
+
+    return SegmentIdentify(
+        user_id=user_id,
+        anonymous_id=anonymous_id,
+        traits=body.get("traits", {}),
+        integrations=body.get("integrations", {}),
+        # Without a client timestamp, Segment's client stamps the event when queued
+        timestamp=body.get("originalTimestamp") or "",
+        context=format_request_context(request, body, properties, anonymous_id),
+    )
+
+
+def build_page_model(body: dict, request: Request) -> SegmentPage:
+    """
+    Build a `SegmentPage` event from the request body
+    """
+
+    user_id, anonymous_id = get_ids(body)
+    properties = format_properties(body, referrer=request.headers.get("referer"))
+
+    return SegmentPage(
+        user_id=user_id,
+        anonymous_id=anonymous_id,
+        name=body.get("name"),  # was formally title
+        category=body.get("category"),
+        properties=properties,
+        integrations=body.get("integrations", {}),
+        timestamp=body.get("originalTimestamp") or "",
+        context=format_request_context(request, body, properties, anonymous_id),
+    )
+
+
+def build_track_model(body: dict, request: Request) -> SegmentTrack:
+    """
+    Build a `SegmentTrack` event from the request body
+    """
 
-    return args
+    user_id, anonymous_id = get_ids(body)
+    properties = format_properties(body, referrer=request.headers.get("referer"))
+
+    return SegmentTrack(
+        event_name=body.get("event", body.get("event_name", "no event name")),
+        user_id=user_id,
+        anonymous_id=anonymous_id,
+        properties=properties,
+        integrations=body.get("integrations", {}),
+        timestamp=body.get("originalTimestamp") or "",
+        context=format_request_context(request, body, properties, anonymous_id),
+    )